@@ -1,12 +1,66 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import os
+import re
 import pandas as pd
-import threading
+import numpy as np
+import queue
+import gc
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import shelve
 from rdkit import Chem
 from spectral_denoising import file_io, spectral_denoising
 from pipeline import denoising_pipeline
 
+# SMILES patterns inside MSP comment fields
+_SMILES_RE_COMPUTED = re.compile(r'computed SMILES=([^"]+)')
+_SMILES_RE_PLAIN = re.compile(r'SMILES=([^"]+)')
+
+# Persistent SMILES -> validity cache, shared across load sessions
+_SMILES_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'spectral_denoising', 'smiles_validity')
+
+# Column name variations (lower case) -> standardized names
+_COLUMN_MAPPING = {
+    # Peaks/spectra variations
+    'msms': 'peaks',
+    'ms/ms': 'peaks',
+    'peak': 'peaks',
+    'peaks': 'peaks',
+    'spectra': 'peaks',
+    'spectrum': 'peaks',
+    # SMILES variations
+    'smile': 'smiles',
+    'smiles': 'smiles',
+    # Adduct variations
+    'adduct': 'adducts',
+    'adducts': 'adducts',
+}
+
+def _detect_format(path):
+    """Sniff the first 4 KB of the file and return 'msp', 'csv', or None if undecided"""
+    with open(path, 'r', errors='ignore') as f:
+        head = f.read(4096)
+    lines = [line for line in head.splitlines() if line.strip()]
+    if not lines:
+        return None
+    first_line = lines[0]
+    # MSP records start with 'Name:'; a CSV header line has commas and no 'key:' layout
+    if first_line.lower().startswith('name:') or ('num peaks:' in head.lower() and ',' not in first_line):
+        return 'msp'
+    if ',' in first_line:
+        return 'csv'
+    return None
+
+def _process_data_worker(data, mass_tol, output_path, progress_queue):
+    """Denoise and save the data in the worker process, reporting (current, total) progress through progress_queue"""
+    results = denoising_pipeline(data, mass_tol, progress_callback=lambda current, total: progress_queue.put((current, total)))
+    if output_path.endswith('.csv'):
+        file_io.save_df(results, output_path)
+    else:
+        file_io.write_to_msp(results, output_path, msms_col = 'denoised_peaks')# make sure to change this column!!!
+    return results
+
 class SpectralDenoisingGUI:
     def __init__(self, root):
         self.root = root
@@ -20,68 +74,36 @@ class SpectralDenoisingGUI:
         self.mass_tolerance = tk.DoubleVar(value=0.005)
         self.mass_mode = tk.StringVar(value="orbitrap")  # orbitrap/tof/custom
         self.loaded_data = None
+        self.results = None
+        self._log_queue = queue.Queue()
+        self._future = None
         
         self.create_widgets()
+        self.root.after(100, self._flush_log)
     
     def standardize_columns(self, df):
         """Standardize column names to a consistent format (case-insensitive mapping)"""
-        # Define column mappings
-        column_mapping = {
-            # Peaks/spectra variations
-            'msms': 'peaks',
-            'ms/ms': 'peaks',
-            'peak': 'peaks',
-            'peaks': 'peaks',
-            'spectra': 'peaks',
-            'spectrum': 'peaks',
-            # SMILES variations
-            'smile': 'smiles',
-            'smiles': 'smiles',
-            # Adduct variations
-            'adduct': 'adducts',
-            'adducts': 'adducts',
-        }
-        
         # Create a mapping of current column names to standardized names
-        new_columns = {}
-        for col in df.columns:
-            col_lower = col.lower()
-            if col_lower in column_mapping:
-                new_columns[col] = column_mapping[col_lower]
-                self.log_message(f"Mapped column '{col}' -> '{column_mapping[col_lower]}'")
+        new_columns = {c: _COLUMN_MAPPING[c.lower()] for c in df.columns if c.lower() in _COLUMN_MAPPING}
         
         # Rename columns
         if new_columns:
+            self.log_message(f"Renamed {len(new_columns)} columns: {new_columns}")
             df = df.rename(columns=new_columns)
-            self.log_message(f"Column standardization complete")
         else:
             self.log_message("No column names needed standardization")
         
         return df
     
-    def extract_smiles_from_comments(self, comments_str):
-        """Extract SMILES string from comments field"""
-        if pd.isna(comments_str) or not isinstance(comments_str, str):
-            return None
-        
-        # Look for 'computed SMILES=' pattern
-        import re
-        match = re.search(r'computed SMILES=([^"]+)', comments_str)
-        if match:
-            return match.group(1).strip()
-        
-        # Also try 'SMILES=' pattern (without 'computed')
-        match = re.search(r'SMILES=([^"]+)', comments_str)
-        if match:
-            return match.group(1).strip()
-        
-        return None
-    
     def fill_missing_smiles(self, df):
         """Fill missing SMILES column from comments if available"""
         if 'smiles' not in df.columns and 'comments' in df.columns:
             self.log_message("SMILES column not found, attempting to extract from comments...")
-            df['smiles'] = df['comments'].apply(self.extract_smiles_from_comments)
+            # Prefer 'computed SMILES=', fall back to plain 'SMILES='
+            comments = df['comments'].astype(str)
+            extracted = comments.str.extract(_SMILES_RE_COMPUTED, expand=False)
+            extracted = extracted.fillna(comments.str.extract(_SMILES_RE_PLAIN, expand=False))
+            df['smiles'] = extracted.str.strip()
             
             # Count how many were successfully extracted
             valid_smiles = df['smiles'].notna().sum()
@@ -93,6 +115,28 @@ class SpectralDenoisingGUI:
         
         return df
     
+    def check_smiles_validity(self, unique_smiles):
+        """Map each SMILES to its RDKit validity, only parsing SMILES missing from the disk cache"""
+        try:
+            os.makedirs(os.path.dirname(_SMILES_CACHE_PATH), exist_ok=True)
+            with shelve.open(_SMILES_CACHE_PATH) as cache:
+                valid_map = {}
+                misses = {}
+                for s in unique_smiles:
+                    key = str(s)
+                    if key in cache:
+                        valid_map[s] = cache[key]
+                    else:
+                        misses[key] = Chem.MolFromSmiles(key) is not None
+                        valid_map[s] = misses[key]
+                cache.update(misses)
+            self.log_message(f"SMILES cache: {len(unique_smiles) - len(misses)}/{len(unique_smiles)} hits")
+            return valid_map
+        except Exception as e:
+            # Cache unavailable (e.g. locked or unwritable), validate everything directly
+            self.log_message(f"SMILES cache unavailable ({str(e)}), validating without cache")
+            return {s: Chem.MolFromSmiles(str(s)) is not None for s in unique_smiles}
+    
     def validate_smiles(self, df):
         """Validate all SMILES in the dataframe using RDKit"""
         if 'smiles' not in df.columns:
@@ -100,20 +144,14 @@ class SpectralDenoisingGUI:
         
         self.log_message("Validating SMILES structures...")
         
-        invalid_indices = []
-        invalid_smiles = []
-        
-        for idx, smiles in enumerate(df['smiles']):
-            if pd.isna(smiles):
-                invalid_indices.append(idx)
-                invalid_smiles.append('(missing)')
-                continue
-            
-            mol = Chem.MolFromSmiles(str(smiles))
-            if mol is None:
-                invalid_indices.append(idx)
-                invalid_smiles.append(str(smiles))
-        
+        # Parse each unique SMILES only once, libraries often repeat structures
+        unique_smiles = df['smiles'].dropna().unique()
+        valid_map = self.check_smiles_validity(unique_smiles)
+        valid_mask = df['smiles'].map(lambda s: False if pd.isna(s) else valid_map.get(s, False)).values.astype(bool)
+
+        invalid_indices = np.where(~valid_mask)[0]
+        invalid_smiles = ['(missing)' if pd.isna(s) else str(s) for s in df['smiles'].iloc[invalid_indices[:5]]]
+
         total = len(df)
         invalid_count = len(invalid_indices)
         valid_count = total - invalid_count
@@ -142,7 +180,7 @@ class SpectralDenoisingGUI:
                 return None
             
             # Drop rows with invalid SMILES
-            df = df.drop(df.index[invalid_indices]).reset_index(drop=True)
+            df = df.loc[valid_mask].reset_index(drop=True)
             self.log_message(f"Dropped {invalid_count} rows with invalid SMILES")
             self.log_message(f"Remaining rows: {len(df)}")
         
@@ -254,12 +292,23 @@ class SpectralDenoisingGUI:
         self.on_mass_mode_change()
     
     def log_message(self, message):
-        """Add message to log window"""
-        self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, message + '\n')
-        self.log_text.see(tk.END)
-        self.log_text.config(state='disabled')
-        self.root.update_idletasks()
+        """Queue message for the log window (safe to call from worker threads)"""
+        self._log_queue.put(message)
+    
+    def _flush_log(self):
+        """Drain queued log messages into the log window, rescheduled every 100 ms"""
+        messages = []
+        while True:
+            try:
+                messages.append(self._log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if messages:
+            self.log_text.config(state='normal')
+            self.log_text.insert(tk.END, '\n'.join(messages) + '\n')
+            self.log_text.see(tk.END)
+            self.log_text.config(state='disabled')
+        self.root.after(100, self._flush_log)
     
     def update_progress(self, current, total):
         """Update progress bar with current progress"""
@@ -267,7 +316,6 @@ class SpectralDenoisingGUI:
             percentage = (current / total) * 100
             self.progress_bar['value'] = percentage
             self.progress_label.config(text=f"{int(percentage)}% ({current}/{total})")
-            self.root.update_idletasks()
 
     def on_mass_mode_change(self):
         """Handle mass tolerance preset selection"""
@@ -335,6 +383,12 @@ class SpectralDenoisingGUI:
         try:
             self.log_message(f"Loading file: {file_path}")
             
+            # Trust the file content over the extension/radio button
+            detected_type = _detect_format(file_path)
+            if detected_type is not None and detected_type != self.file_type.get():
+                self.log_message(f"File content looks like {detected_type.upper()}, switching file type")
+                self.file_type.set(detected_type)
+            
             if self.file_type.get() == 'msp':
                 self.loaded_data = file_io.read_msp(file_path)
                 self.log_message(f"Successfully loaded MSP file with {len(self.loaded_data)} spectra")
@@ -381,44 +435,67 @@ class SpectralDenoisingGUI:
     def process_data(self):
         """Process the loaded data"""
         if self.loaded_data is None:
-            messagebox.showerror("Error", "Please load a file first")
+            if self.results is not None:
+                # Raw input is released after each successful run to save memory
+                messagebox.showerror("Error", "Input data was released after the last run.\nPlease reload the file before reprocessing")
+            else:
+                messagebox.showerror("Error", "Please load a file first")
             return
         
         if not self.output_file_path.get():
             messagebox.showwarning("Warning", "No output path specified")
             return
         
-        # Run processing in a separate thread to avoid freezing GUI
-        thread = threading.Thread(target=self._process_data_thread)
-        thread.start()
-    
-    def _process_data_thread(self):
-        """Background thread for processing data"""
+        if self._future is not None and not self._future.done():
+            messagebox.showwarning("Warning", "Processing is already running")
+            return
+        
         try:
             self.progress_bar['value'] = 0
             self.progress_label.config(text="0%")
             self.log_message("Starting data processing...")
             
-            # Example processing - modify this based on your actual needs
-            # This is where you'd call your spectral_denoising functions
-            
             mass_tol = self.mass_tolerance.get()
             self.log_message(f"Using mass tolerance: {mass_tol}")
+            self._output_path = self.output_file_path.get()
             
-            # Example: Process the data with progress callback
-            # If your data has msms, smiles, and adduct columns:
-            # self.results = denoising_pipeline(self.loaded_data, mass_tol, progress_callback=self.update_progress)
-            self.results = denoising_pipeline(self.loaded_data, mass_tol)
-            # For now, just demonstrate saving
-            output_path = self.output_file_path.get()
+            # Run processing in a separate process to keep the GUI responsive and isolate crashes
+            ctx = mp.get_context('spawn')
+            self._manager = ctx.Manager()
+            self._progress_queue = self._manager.Queue()
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=ctx)
+            self._future = self._executor.submit(_process_data_worker, self.loaded_data, mass_tol,
+                                                 self._output_path, self._progress_queue)
+            self.root.after(200, self._poll_future)
             
-            if isinstance(self.loaded_data, pd.DataFrame):
-                if output_path.endswith('.csv'):
-                    # self.loaded_data.to_csv(output_path, index=False)
-                    file_io.save_df(self.results, output_path)
-                    self.log_message(f"Saved results to: {output_path}")
-                else:
-                    file_io.write_to_msp(self.results, output_path, msms_col = 'denoised_peaks')# make sure to change this column!!!
+        except Exception as e:
+            self.progress_bar['value'] = 0
+            self.progress_label.config(text="Error")
+            self.log_message(f"Error during processing: {str(e)}")
+            messagebox.showerror("Error", f"Processing failed:\n{str(e)}")
+    
+    def _poll_future(self):
+        """Forward progress from the worker process and handle its result, rescheduled every 200 ms"""
+        while True:
+            try:
+                current, total = self._progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.update_progress(current, total)
+        
+        if not self._future.done():
+            self.root.after(200, self._poll_future)
+            return
+        
+        self._executor.shutdown(wait=False)
+        self._manager.shutdown()
+        try:
+            self.results = self._future.result()
+            self.log_message(f"Saved results to: {self._output_path}")
+            
+            # Results are saved, drop the raw input to halve peak memory
+            self.loaded_data = None
+            gc.collect()
             
             self.progress_bar['value'] = 100
             self.progress_label.config(text="100%")
@@ -436,6 +513,10 @@ class SpectralDenoisingGUI:
         self.input_file_path.set("")
         self.output_file_path.set("")
         self.loaded_data = None
+        self.results = None
+        # Discard messages that have not been flushed yet
+        while not self._log_queue.empty():
+            self._log_queue.get_nowait()
         self.log_text.config(state='normal')
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state='disabled')
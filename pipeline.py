@@ -1,19 +1,52 @@
 from spectral_denoising.spectral_denoising import spectral_denoising
 from tqdm import tqdm
 import multiprocessing as mp
-from spectral_denoising.spectral_denoising import spectral_denoising_batch
-
-
-
-def denoising_pipeline(input_df, mass_error):
-    input_df.columns = [col.lower() for col in input_df.columns]
-    peaks = input_df['peaks']
-    smiles = input_df['smiles']
-    adducts = input_df['adducts']
-        
-    denoised_peaks = spectral_denoising_batch(peaks, smiles, adducts, mass_tolerance=mass_error)
-    
-    output_df = input_df.copy()
-    output_df['denoised_peaks'] = denoised_peaks
-    
-    return output_df
\ No newline at end of file
+from spectral_denoising.spectral_denoising import spectral_denoising_batch, get_n_workers
+
+
+def _denoise_chunk(args):
+    """
+    Worker function for denoising_pipeline. Denoises one contiguous chunk of spectra serially.
+
+    Parameters:
+        args (tuple): (peaks, smiles, adducts, mass_tolerance) for a single chunk.
+    Returns:
+        list: A list of denoised MS/MS spectra, in the same order as the input chunk.
+    """
+    peaks, smiles, adducts, mass_tolerance = args
+    return [spectral_denoising(msms, smile, adduct, mass_tolerance) for msms, smile, adduct in zip(peaks, smiles, adducts)]
+
+
+def denoising_pipeline(input_df, mass_error, progress_callback=None, chunk_size=1000):
+    """
+    Denoise all spectra in the dataframe. Spectra are split into contiguous chunks that are denoised in parallel.
+
+    Parameters:
+        input_df (pd.DataFrame): DataFrame with 'peaks', 'smiles' and 'adducts' columns.
+        mass_error (float): The mass tolerance for the denoising process.
+        progress_callback (callable, optional): Called as progress_callback(n_done, n_total) after each chunk finishes. Default is None.
+        chunk_size (int, optional): Maximum number of spectra per chunk. Chunks are made smaller for small inputs so all workers are used. Default is 1000.
+    Returns:
+        pd.DataFrame: input_df itself with an added 'denoised_peaks' column. The input is modified in place (no copy is made), so the caller should not rely on it being unchanged.
+    """
+    input_df.columns = input_df.columns.str.lower()
+    peaks = input_df['peaks'].tolist()
+    smiles = input_df['smiles'].tolist()
+    adducts = input_df['adducts'].tolist()
+    total = len(peaks)
+
+    # leave 2 cores free so the GUI stays responsive
+    num_workers = get_n_workers(reserve=2, min_workers=1)
+    chunk_size = max(1, min(chunk_size, -(-total // num_workers)))
+    chunks = [(peaks[start:start+chunk_size], smiles[start:start+chunk_size], adducts[start:start+chunk_size], mass_error)
+              for start in range(0, total, chunk_size)]
+    denoised_peaks = []
+    with mp.Pool(processes=num_workers) as pool:
+        for chunk_result in pool.imap(_denoise_chunk, chunks):
+            denoised_peaks.extend(chunk_result)
+            if progress_callback is not None:
+                progress_callback(len(denoised_peaks), total)
+
+    input_df['denoised_peaks'] = denoised_peaks
+
+    return input_df
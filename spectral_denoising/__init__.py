@@ -1,6 +1,6 @@
 # this is a placeholder for __init__.py
 from .spectral_denoising import spectral_denoising_batch,spectral_denoising, formula_denoising,electronic_denoising
 from .denoising_search import denoising_search, denoising_search_batch
-from .spectra_plotter import head_to_tail_plot
+from .spectra_plotter import head_to_tail_plot, head_to_tail_plot_batch
 from .file_io import read_msp, write_to_msp,read_df,save_df,export_denoising_searches
 from .spectral_operations import entropy_similairty
\ No newline at end of file
@@ -78,26 +78,25 @@ def write_to_msp(df, file_path, msms_col = 'peaks', normalize = False):
     """
     if normalize == True:
         df[msms_col] = [so.normalize_spectrum(peak) for peak in df[msms_col]]
-    with open(file_path, 'w') as f:
-        for _, row in df.iterrows():
-            # Write the name of the spectrum
-            if isinstance(row[msms_col], float):
+    meta_cols = [col for col in df.columns if col not in ['name', msms_col] and 'peak' not in col]
+    meta_labels = [col.capitalize() for col in meta_cols]
+    meta_values = [df[col].tolist() for col in meta_cols]
+    names = df['name'].tolist() if 'name' in df.columns else None
+    # build each record as a list of strings and write it in one go, through a 64 KB buffer
+    with open(file_path, 'w', buffering=1 << 16) as f:
+        for i, msms in enumerate(df[msms_col]):
+            if isinstance(msms, float):
                 continue
-            if 'name' in df.columns:
-                f.write(f"Name: {row['name']}\n")
-            
-            # Write other metadata if available
-            for col in df.columns:
-                if col not in ['name', msms_col] and 'peak' not in col:
-                    f.write(f"{col.capitalize()}: {row[col]}\n")
-            
-            # Write the peaks (assuming each peak is a tuple of (m/z, intensity))
-            f.write(f"Num Peaks: {len(row[msms_col])}\n")
-            for mz, intensity in row[msms_col]:
-                f.write(f"{mz} {intensity}\n")
-            
+            parts = []
+            if names is not None:
+                parts.append(f"Name: {names[i]}\n")
+            for label, values in zip(meta_labels, meta_values):
+                parts.append(f"{label}: {values[i]}\n")
+            parts.append(f"Num Peaks: {len(msms)}\n")
+            parts.extend(f"{mz} {intensity}\n" for mz, intensity in msms)
             # Separate spectra by an empty line
-            f.write("\n")
+            parts.append("\n")
+            f.write(''.join(parts))
 def save_df(df, save_path):
     """
     Pair function of save_df.
@@ -149,12 +148,16 @@ def read_df(path, keep_ms1_only = False):
         - The `check_pattern` function is used to determine which columns to process.
         - The `so.str_to_arr` function is used to convert the values in the selected columns.
     """
-    df = pd.read_csv(path)
+    try:
+        # multi-threaded Arrow CSV reader, falls back to the default C engine if pyarrow is missing or rejects the file
+        df = pd.read_csv(path, engine='pyarrow')
+    except (ImportError, ValueError):
+        df = pd.read_csv(path)
     
     print('done read in df...')
     for col in df.columns:
         if check_pattern(df[col].iloc[0]):
-            df[col] = [so.str_to_arr(y[col]) for x,y in df.iterrows()]
+            df[col] = [so.str_to_arr(msms) for msms in df[col]]
     df =  standardize_col(df)
 
 
@@ -7,26 +7,25 @@ import numpy as np
 from rdkit import Chem
 from tqdm import tqdm
 import matplotlib.pyplot as plt
-from matplotlib import rcParams
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 from . import spectral_operations as so
 import matplotlib.pyplot as plt
 import seaborn as sns
 import plotly.express as px
 import matplotlib as mpl
-mpl.rcParams['font.family'] = 'Arial'
+# applied per plot call with rc_context instead of mutating the global rcParams at import
+_STYLE = {'font.family': 'Arial'}
 def abs_formatter(value, _):
     return f"{abs(value):.0f}"
 
 
-import ast
 import textwrap
+from functools import lru_cache
 def wrap_labels(ax, width, break_long_words=False):
-    labels = []
-    for label in ax.get_xticklabels():
-        text = label.get_text()
-        labels.append(textwrap.fill(text, width=width,
-                                    break_long_words=break_long_words))
-    ax.set_xticklabels(labels, rotation=0)
+    # one wrapper for all labels instead of a new one per textwrap.fill call
+    wrapper = textwrap.TextWrapper(width=width, break_long_words=break_long_words)
+    ax.set_xticklabels([wrapper.fill(label.get_text()) for label in ax.get_xticklabels()], rotation=0)
 def wrap_labels_ylabel(ax, width, break_long_words=False):
     labels = []
 
@@ -34,98 +33,201 @@ def wrap_labels_ylabel(ax, width, break_long_words=False):
     labels.append(textwrap.fill(text, width=width,
                                 break_long_words=break_long_words))
     ax.set_ylabel(labels)
+@lru_cache(maxsize=None)
 def hex_to_RGB(hex_str):
-    """ #FFFFFF -> [255,255,255]"""
+    """ #FFFFFF -> (255,255,255)"""
     #Pass 16 to the integer function for change of base
-    return [int(hex_str[i:i+2], 16) for i in range(1,6,2)]
+    return tuple(int(hex_str[i:i+2], 16) for i in range(1,6,2))
+@lru_cache(maxsize=128)
 def get_color_gradient(c1, c2, n):
     """
     Given two hex colors, returns a color gradient
-    with n colors.
+    with n colors, as a tuple (results are cached, use list(...) if you need to modify it).
     """
     assert n > 1
     c1_rgb = np.array(hex_to_RGB(c1))/255
     c2_rgb = np.array(hex_to_RGB(c2))/255
-    mix_pcts = [x/(n-1) for x in range(n)]
-    rgb_colors = [((1-mix)*c1_rgb + (mix*c2_rgb)) for mix in mix_pcts]
-    return ["#" + "".join([format(int(round(val*255)), "02x") for val in item]) for item in rgb_colors]
+    mix_pcts = (np.arange(n)/(n-1))[:, None]
+    rgb_colors = np.rint(((1-mix_pcts)*c1_rgb + (mix_pcts*c2_rgb))*255).astype(np.uint8)
+    return tuple('#%02x%02x%02x' % tuple(item) for item in rgb_colors)
+_RASTERIZE_PEAKS = 500
+def _peak_collection(mass, intensity, color, linewidth, rasterized = None):
+    """
+    Builds all peaks of a spectrum as a single LineCollection of vertical lines from 0 to intensity.
+    Dense spectra (more than _RASTERIZE_PEAKS peaks) are rasterized, so vector exports (e.g. pdf) embed one image instead of a path per peak.
+
+    Parameters:
+        mass (np.array): m/z values of the peaks.
+        intensity (np.array or list): intensity of the peaks (negative values are drawn downwards).
+        color (str): Color of the peaks.
+        linewidth (float): Line width of the peaks.
+        rasterized (bool or None, optional): True/False forces rasterization on/off, None decides by peak count. Default is None.
+    Returns:
+        matplotlib.collections.LineCollection: The collection, ready for ax.add_collection.
+    """
+    mass = np.asarray(mass, dtype=float)
+    intensity = np.asarray(intensity, dtype=float)
+    segs = np.stack([np.column_stack([mass, np.zeros_like(mass)]), np.column_stack([mass, intensity])], axis=1)
+    return LineCollection(segs, colors=color, linewidths=linewidth, rasterized=len(mass) > _RASTERIZE_PEAKS if rasterized is None else rasterized)
+_BIN_PEAKS = 10000
+def _bin_peaks(mass, intensity, n_bins, mz_range = None):
+    """
+    Reduces very dense spectra (more than _BIN_PEAKS peaks) to one peak per output pixel, keeping the highest intensity of each pixel column. Sparser spectra are returned unchanged.
+
+    Parameters:
+        mass (np.array): m/z values of the peaks.
+        intensity (np.array): intensity of the peaks, all of the same sign (negative for a mirrored spectrum).
+        n_bins (int): Number of bins, normally the width of the axes in output pixels (see _axes_width_px).
+        mz_range (tuple, optional): (start, end) m/z range shown on the axes. Peaks outside are dropped. Default is None, which bins the full data range.
+    Returns:
+        tuple: (mass, intensity) with mass at the bin centers.
+    """
+    if len(mass) <= _BIN_PEAKS:
+        return mass, intensity
+    if mz_range is None:
+        mz_range = (mass.min(), mass.max())
+    edges = np.linspace(mz_range[0], mz_range[1], n_bins+1)
+    idx = np.searchsorted(edges, mass, side = 'right')-1
+    # the last edge belongs to the last bin
+    idx[mass == edges[-1]] = n_bins-1
+    inside = (idx >= 0) & (idx < n_bins)
+    heights = np.zeros(n_bins)
+    np.maximum.at(heights, idx[inside], np.abs(intensity[inside]))
+    keep = heights > 0
+    sign = -1.0 if intensity.max() <= 0 else 1.0
+    return ((edges[:-1]+edges[1:])/2)[keep], sign*heights[keep]
+def _axes_width_px(ax, dpi = 300):
+    """
+    Width of the axes in pixels at the savefig resolution (dpi=300 throughout this module).
+    """
+    return max(1, int(ax.bbox.width / ax.figure.dpi * dpi))
+def _top_peaks(mass, intensity, max_peaks):
+    """
+    Keeps only the max_peaks most intense peaks (in their original m/z order), since peaks beyond that mostly overlap sub-pixel.
+
+    Parameters:
+        mass (np.array): m/z values of the peaks.
+        intensity (np.array): intensity of the peaks.
+        max_peaks (int or None): Maximum number of peaks to keep. If None, all peaks are kept.
+    Returns:
+        tuple: (mass, intensity) of the kept peaks.
+    """
+    if max_peaks is None or len(mass) <= max_peaks:
+        return mass, intensity
+    idx = np.sort(np.argpartition(intensity, -max_peaks)[-max_peaks:])
+    return mass[idx], intensity[idx]
+@lru_cache(maxsize=128)
+def _parse_spectrum_str(msms):
+    return np.fromstring(msms.replace('[', ' ').replace(']', ' ').replace(',', ' '), sep=' ').reshape(-1, 2)
+def _parse_spectrum(msms):
+    """
+    Converts a spectrum given as a string (e.g. '[[mz1, intensity1], [mz2, intensity2]]' or a printed np.array) into a 2D np.array.
+
+    Parameters:
+        msms (np.array or str): The spectrum. np.arrays are returned as is.
+    Returns:
+        np.array: The spectrum in 2D np.array format.
+    """
+    if isinstance(msms, np.ndarray):
+        return msms
+    if isinstance(msms, str):
+        # copy, so in-place sorting downstream does not alter the cached array
+        return _parse_spectrum_str(msms).copy()
+    return np.asarray(msms, dtype=float)
+def _normalize(intensity, sign = 1.0, out = None):
+    """
+    Scales intensities so that the base peak is sign*100. Shared by all plot functions; the negation of the mirrored spectrum is fused into the scaling factor, so it is one max and one multiply.
+
+    Parameters:
+        intensity (np.array): intensity of the peaks.
+        sign (float, optional): 1.0 for an upward spectrum, -1.0 for a mirrored one. Default is 1.0.
+        out (np.array, optional): Output array, pass intensity itself to scale in place. Default is None.
+    Returns:
+        np.array: The scaled intensities. An empty input (e.g. no peak in the zoom window) is returned unchanged.
+    """
+    if np.size(intensity) == 0:
+        return intensity
+    return np.multiply(intensity, sign*100.0 / intensity.max(), out = out)
+def _prep_spectrum(msms, max_mz = None, sign = 1.0):
+    """
+    Sorts (only if needed), truncates and normalizes a spectrum for plotting in one go, without modifying the input.
+
+    Parameters:
+        msms (np.array): Spectrum in 2D np.array format.
+        max_mz (float, optional): Only peaks with m/z below max_mz are kept. Default is None (keep all).
+        sign (float, optional): 1.0 for peaks pointing up, -1.0 for the mirrored spectrum. Default is 1.0.
+    Returns:
+        tuple: (mass, intensity) with intensity scaled so that the base peak is sign*100.
+    """
+    mass, intensity = msms[:, 0], msms[:, 1]
+    if not np.all(mass[:-1] <= mass[1:]):
+        order = np.argsort(mass)
+        mass, intensity = mass[order], intensity[order]
+    if max_mz is not None:
+        upper_allowed = np.searchsorted(mass, max_mz, side = 'left')
+        mass, intensity = mass[:upper_allowed], intensity[:upper_allowed]
+    return mass, _normalize(intensity, sign)
+_FIG_CACHE = {}
+def _get_fig(figsize, reuse = True):
+    """
+    Returns a cleared, cached figure of the given size, so batch plotting does not rebuild a figure per call.
+    Cached figures are not registered with pyplot, so they never pile up in its global figure list.
+
+    Parameters:
+        figsize (tuple): Figure size in inches.
+        reuse (bool, optional): If False, always create a new figure. Use this when the figure is handed back to the caller. Default is True.
+    Returns:
+        matplotlib.figure.Figure: The figure to draw on.
+    """
+    if not reuse:
+        return plt.figure(figsize = figsize)
+    fig = _FIG_CACHE.get(figsize)
+    if fig is None:
+        fig = Figure(figsize = figsize)
+        _FIG_CACHE[figsize] = fig
+    else:
+        fig.clear()
+        # restore the default margins, otherwise the previous tight_layout carries over
+        fig.subplots_adjust(**{k: mpl.rcParams['figure.subplot.'+k] for k in ['left', 'right', 'bottom', 'top', 'wspace', 'hspace']})
+    return fig
 # reference_db_sorted = pd.read_csv('/Users/fanzhoukong/Documents/GitHub/Libgen_data/formula_db/formulaDB_sorted.csv')
-def head_to_tail_plot(msms1, msms2,pmz=None,mz_start = None, mz_end = None, pmz2= None,ms2_error = 0.02,title = None,
-                      color1 = None, color2 = None,manual_min = None,
-                      savepath = None, show= True, publication = False,fontsize = 12, eps = False, linewidth = 1):
+def _draw_head_to_tail(ax, msms1, msms2, pmz = None, mz_start = None, mz_end = None, pmz2 = None, ms2_error = 0.02, title = None,
+                       color1 = None, color2 = None, manual_min = None, publication = False, linewidth = 1, rasterized = None, verbose = False):
     """
-    Plots a head-to-tail comparison of two MS/MS spectra.
+    Draws a head-to-tail comparison of two MS/MS spectra on the given axes. Shared by head_to_tail_plot and head_to_tail_plot_batch, see head_to_tail_plot for the parameters.
 
     Parameters:
-        msms1 (np.array): First mass spectrum data in 2D np.array format. e,g. np.array([[mz1, intensity1], [mz2, intensity2], ...]).
-        msms2 (np.array): Second mass spectrum data. Same as msms1.
-        pmz (float or str, optional): Precursor m/z value for the first spectrum. Default is None. If given, precursors will be removed from both spectra and precursor will be shown as a grey
-        dashed line in the plot.
-        mz_start (float, optional): Start of the m/z range for plotting. Zoom in function. Default is None.
-        mz_end (float, optional): End of the m/z range for plotting. Zoom in function. Default is None.
-        pmz2 (float or str, optional): Precursor m/z value for the second spectrum. Default is None. Just in case pmz1 and pmz2 are different.
-        ms2_error (float, optional): Error tolerance for m/z values. Default is 0.02.
-        color1 (str, optional): Color for the first spectrum's peaks. Default is None.
-        color2 (str, optional): Color for the second spectrum's peaks. Default is None.
-        
-        savepath (str, optional): Path to save the plot image. Default is None.
-        show (bool, optional): If True, displays the plot. Default is True. Turn it off if you want to save the plot without displaying it.
-        publication (bool, optional): If True, formats the plot for publication (size 3*2.5 inch for single column figure). Default is False.
-        fontsize (int, optional): Font size for plot labels. Default is 12.
+        ax (matplotlib.axes.Axes): The axes to draw on.
+        rasterized (bool or None, optional): Passed to _peak_collection. Default is None.
     Returns:
-        matplotlib.pyplot or None: The plot object if show is True, otherwise None.
+        None
     """
-                      
-    
     if isinstance(pmz, str):
         pmz = float(pmz)
-    if msms1 is float or msms2 is float:
-        # return(np.NAN)
-        return(0)
-    if isinstance(msms1, str):
-        msms1 = ast.literal_eval(msms1)
-    if isinstance(msms2, str):
-        msms2 = ast.literal_eval(msms2)
-    msms1 = so.sort_spectrum(msms1)
-    msms2 = so.sort_spectrum(msms2)
+    msms1 = _parse_spectrum(msms1)
+    msms2 = _parse_spectrum(msms2)
     if pmz is not None:
         if pmz2 is None:
             pmz2 = pmz
-    print('entropy similarity is', so.entropy_similairty(msms1, msms2, pmz, ms2_error = ms2_error))
+    if verbose:
+        print('entropy similarity is', so.entropy_similairty(msms1, msms2, pmz, ms2_error = ms2_error))
     if pmz is not None and pmz2 is not None:
-        msms1 = so.truncate_spectrum(msms1, pmz-1.6)
-        msms2= so.truncate_spectrum(msms2, pmz2-1.6)
-    mass1, intensity1 = msms1.T[0], msms1.T[1]
-    intensity_nor1 = [x/np.max(intensity1)*100 for x in intensity1]
-
-    mass2, intensity2 = msms2.T[0], msms2.T[1]
-    intensity_nor2 = [x/np.max(intensity2)*100 for x in intensity2]
-    intensity_nor2=[-x for x in intensity_nor2]
-    # print(intensity_nor2)
-    if publication == True:
-        wid = 1.9
-        hi = 1.9/2*1.75
+        mass1, intensity_nor1 = _prep_spectrum(msms1, pmz-1.6)
+        mass2, intensity_nor2 = _prep_spectrum(msms2, pmz2-1.6, sign = -1.0)
     else:
-        wid = 8
-        hi = 6
-    # print(intensity_nor1
-    fig = plt.figure(figsize = (wid, hi))#43
-    plt.subplots_adjust()
-    ax = fig.add_subplot()
-    for i in range(len(mass1)):
-        if color1 == None:
-            plt.vlines(x = mass1[i], ymin = 0, ymax = intensity_nor1[i],color = 'blue', linewidth = linewidth)
-        elif color1 != None:
-            plt.vlines(x = mass1[i], ymin = 0, ymax = intensity_nor1[i],color = color1,linewidth = linewidth)
+        mass1, intensity_nor1 = _prep_spectrum(msms1)
+        mass2, intensity_nor2 = _prep_spectrum(msms2, sign = -1.0)
+    mz_range = (mz_start, mz_end) if mz_start is not None and mz_end is not None else None
+    mass1, intensity_nor1 = _bin_peaks(mass1, intensity_nor1, _axes_width_px(ax), mz_range)
+    mass2, intensity_nor2 = _bin_peaks(mass2, intensity_nor2, _axes_width_px(ax), mz_range)
+    ax.add_collection(_peak_collection(mass1, intensity_nor1, color1 or 'blue', linewidth, rasterized = rasterized))
     if pmz != None:
-        plt.vlines(x = pmz, ymin = 0, ymax = 100,color = 'grey', linestyle='dashed',linewidth = linewidth)
-    for i in range(len(mass2)):
-        if color2 ==None:
-            plt.vlines(x = mass2[i], ymin = intensity_nor2[i], ymax =0 ,color = 'r',linewidth = linewidth)
-        elif color2 != None:
-            plt.vlines(x = mass2[i], ymin = intensity_nor2[i], ymax =0 ,color = color2,linewidth = linewidth)
+        ax.axvline(pmz, ymin = 0.5, ymax = 1.0, color = 'grey', linestyle='--', linewidth = linewidth)
+    ax.add_collection(_peak_collection(mass2, intensity_nor2, color2 or 'r', linewidth, rasterized = rasterized))
     if pmz2 != None:
-        plt.vlines(x = pmz2, ymin = -100, ymax = 0,color = 'grey', linestyle='dashed',linewidth = linewidth)
+        ax.axvline(pmz2, ymin = 0.0, ymax = 0.5, color = 'grey', linestyle='--', linewidth = linewidth)
+    # autoscale once all peaks and precursor markers are in the data limits
+    ax.autoscale_view()
 
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
@@ -150,25 +252,125 @@ def head_to_tail_plot(msms1, msms2,pmz=None,mz_start = None, mz_end = None, pmz2
 
 
     ax.yaxis.set_major_formatter(plt.FuncFormatter(abs_formatter))
-    plt.axhline(y=0, color='black', linestyle='-')
-    start, end = ax.get_ylim()
+    ax.axhline(y=0, color='black', linestyle='-')
     if manual_min is not None:
         ax.set_xlim(manual_min, pmz+2)
-    plt.tight_layout()
     ax.set_facecolor("none")
     ax.grid(False)
-    plt.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
+    ax.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
     if title != None:
-        plt.title(title)
-    plt.tight_layout()
+        ax.set_title(title)
+@mpl.rc_context(_STYLE)
+def head_to_tail_plot(msms1, msms2,pmz=None,mz_start = None, mz_end = None, pmz2= None,ms2_error = 0.02,title = None,
+                      color1 = None, color2 = None,manual_min = None,
+                      savepath = None, show= True, publication = False,fontsize = 12, eps = False, linewidth = 1, verbose = False):
+    """
+    Plots a head-to-tail comparison of two MS/MS spectra.
+
+    Parameters:
+        msms1 (np.array): First mass spectrum data in 2D np.array format. e,g. np.array([[mz1, intensity1], [mz2, intensity2], ...]).
+        msms2 (np.array): Second mass spectrum data. Same as msms1.
+        pmz (float or str, optional): Precursor m/z value for the first spectrum. Default is None. If given, precursors will be removed from both spectra and precursor will be shown as a grey
+        dashed line in the plot.
+        mz_start (float, optional): Start of the m/z range for plotting. Zoom in function. Default is None.
+        mz_end (float, optional): End of the m/z range for plotting. Zoom in function. Default is None.
+        pmz2 (float or str, optional): Precursor m/z value for the second spectrum. Default is None. Just in case pmz1 and pmz2 are different.
+        ms2_error (float, optional): Error tolerance for m/z values. Default is 0.02.
+        color1 (str, optional): Color for the first spectrum's peaks. Default is None.
+        color2 (str, optional): Color for the second spectrum's peaks. Default is None.
+        
+        savepath (str, optional): Path to save the plot image. Default is None.
+        show (bool, optional): If True, displays the plot. Default is True. Turn it off if you want to save the plot without displaying it.
+        publication (bool, optional): If True, formats the plot for publication (size 3*2.5 inch for single column figure) and rasterizes the peaks (except for eps). Default is False.
+        fontsize (int, optional): Font size for plot labels. Default is 12.
+        verbose (bool, optional): If True, prints the entropy similarity of the two spectra. Default is False.
+    Returns:
+        matplotlib.figure.Figure or None: The figure if show is True, otherwise None. Close it with plt.close(fig) when done.
+    """
+                      
+    
+    if msms1 is float or msms2 is float:
+        # return(np.NAN)
+        return(0)
+    if publication == True:
+        wid = 1.9
+        hi = 1.9/2*1.75
+    else:
+        wid = 8
+        hi = 6
+    # the eps backend embeds rasters uncompressed, which is larger than the vector peaks
+    rasterized = False if eps else (True if publication else None)
+    fig = _get_fig((wid, hi), reuse = not show)#43
+    fig.subplots_adjust()
+    ax = fig.add_subplot()
+    _draw_head_to_tail(ax, msms1, msms2, pmz = pmz, mz_start = mz_start, mz_end = mz_end, pmz2 = pmz2, ms2_error = ms2_error, title = title,
+                       color1 = color1, color2 = color2, manual_min = manual_min, publication = publication, linewidth = linewidth,
+                       rasterized = rasterized, verbose = verbose)
+    # a single layout pass once all text artists exist
+    fig.tight_layout()
     if savepath != None:
-        plt.tight_layout()
         if eps == True:
-            plt.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none', format = 'eps')
+            fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none', format = 'eps')
         else:
-            plt.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none')
+            fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none')
     if show==True:
-        return(plt)
+        return(fig)
+    else:
+        return()
+@mpl.rc_context(_STYLE)
+def head_to_tail_plot_batch(pairs, ncols = 4, mz_start = None, mz_end = None, ms2_error = 0.02, color1 = None, color2 = None,
+                            savepath = None, show = True, publication = False, eps = False, linewidth = 1):
+    """
+    Plots many head-to-tail comparisons as panels of a single figure, so the figure setup and layout are paid once instead of per pair.
+
+    Parameters:
+        pairs (list): List of (msms1, msms2) or (msms1, msms2, pmz) tuples, one per panel. Pairs with an empty spectrum (np.nan) get an empty panel.
+        ncols (int, optional): Number of panels per row. Default is 4.
+        mz_start (float, optional): Start of the m/z range for all panels. Default is None.
+        mz_end (float, optional): End of the m/z range for all panels. Default is None.
+        ms2_error (float, optional): Error tolerance for m/z values. Default is 0.02.
+        color1 (str, optional): Color for the first spectrum's peaks. Default is None.
+        color2 (str, optional): Color for the second spectrum's peaks. Default is None.
+        savepath (str, optional): Path to save the plot image. Default is None.
+        show (bool, optional): If True, returns the figure. Default is True. Turn it off when saving many batches, the figure is then reused between calls.
+        publication (bool, optional): If True, each panel uses the publication formatting of head_to_tail_plot. Default is False.
+        eps (bool, optional): If True, saves the figure in eps format. Default is False.
+        linewidth (float, optional): Line width of the peaks. Default is 1.
+    Returns:
+        matplotlib.figure.Figure or None: The figure if show is True, otherwise None. Close it with plt.close(fig) when done.
+    """
+    pairs = list(pairs)
+    if len(pairs) == 0:
+        return()
+    ncols = max(1, min(ncols, len(pairs)))
+    nrows = -(-len(pairs) // ncols)
+    if publication == True:
+        wid = 1.9
+        hi = 1.9/2*1.75
+    else:
+        wid = 8
+        hi = 6
+    rasterized = False if eps else (True if publication else None)
+    fig = _get_fig((wid*ncols, hi*nrows), reuse = not show)
+    axes = fig.subplots(nrows, ncols, squeeze = False)
+    for ax, pair in zip(axes.flat, pairs):
+        msms1, msms2 = pair[0], pair[1]
+        pmz = pair[2] if len(pair) > 2 else None
+        if isinstance(msms1, float) or isinstance(msms2, float):
+            ax.set_axis_off()
+            continue
+        _draw_head_to_tail(ax, msms1, msms2, pmz = pmz, mz_start = mz_start, mz_end = mz_end, ms2_error = ms2_error,
+                           color1 = color1, color2 = color2, publication = publication, linewidth = linewidth, rasterized = rasterized)
+    for ax in axes.flat[len(pairs):]:
+        ax.set_axis_off()
+    fig.tight_layout()
+    if savepath != None:
+        if eps == True:
+            fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none', format = 'eps')
+        else:
+            fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'none')
+    if show==True:
+        return(fig)
     else:
         return()
 
@@ -179,7 +381,8 @@ def head_to_tail_plot(msms1, msms2,pmz=None,mz_start = None, mz_end = None, pmz2
 
 
 
-def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color = 'blue'):
+@mpl.rc_context(_STYLE)
+def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color = 'blue', max_peaks = 2000, show = True):
     
     """
     Plots a single MS/MS spectrum.
@@ -191,13 +394,18 @@ def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color
         upper (float, optional): Upper bound for m/z values to be plotted. Default is None.
         savepath (str, optional): Path to save the plot image. If None, the plot will not be saved. Default is None.
         color (str, optional): Color of the spectrum lines. Default is 'blue'.
+        max_peaks (int, optional): Only the max_peaks most intense peaks are drawn. None draws all peaks. Default is 2000.
+        show (bool, optional): If True, returns the figure. Default is True. Turn it off when saving many plots, the figure is then reused between calls.
     Returns:
-        matplotlib.pyplot: The plot object.
+        matplotlib.figure.Figure or None: The figure if show is True, otherwise None. Close it with plt.close(fig) when done.
     """
 
-    if pmz is not None:
-        msms_1 = so.truncate_spectrum(msms_1, pmz-1.6)
-    mass1, intensity1 = msms_1.T[0], msms_1.T[1]
+    msms_1 = np.ascontiguousarray(msms_1)
+    mass1, intensity1 = msms_1[:, 0], msms_1[:, 1]
+    # searchsorted needs ascending m/z, otherwise the bounds below are silently wrong
+    if not np.all(mass1[:-1] <= mass1[1:]):
+        order = np.argsort(mass1)
+        mass1, intensity1 = mass1[order], intensity1[order]
 
     if lower is not None:
         idx_left = np.searchsorted(mass1, lower, side= 'left')
@@ -207,18 +415,23 @@ def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color
         idx_right = np.searchsorted(mass1, upper, side = 'right')
     else:
         idx_right = len(mass1)
-    mass1 = mass1[idx_left:idx_right]
-    intensity1 = intensity1[idx_left:idx_right]
-    normalized_intensity = [x/np.max(intensity1)*100 for x in intensity1]
+    if pmz is not None:
+        # remove the precursor, same cut as so.truncate_spectrum(msms_1, pmz-1.6)
+        idx_right = min(idx_right, np.searchsorted(mass1, pmz-1.6, side = 'left'))
+    slc = slice(idx_left, idx_right)
+    mass1, intensity1 = _top_peaks(mass1[slc], intensity1[slc], max_peaks)
+    normalized_intensity = _normalize(intensity1)
 
 
-    fig = plt.figure(figsize = (4, 3))
-    plt.subplots_adjust()
+    fig = _get_fig((4, 3), reuse = not show)
+    fig.subplots_adjust()
     ax = fig.add_subplot()
-    for i in range(len(mass1)):
-        plt.vlines(x = mass1[i], ymin = 0, ymax = normalized_intensity[i],color = color, linewidth=2)
+    mass1, normalized_intensity = _bin_peaks(mass1, normalized_intensity, _axes_width_px(ax))
+    ax.add_collection(_peak_collection(mass1, normalized_intensity, color, 2))
     if pmz != None:
-        plt.vlines(x = pmz, ymin = 0, ymax = 100,color = 'grey', linestyle='dashed')
+        ax.axvline(pmz, ymin = 0.0, ymax = 1.0, color = 'grey', linestyle='--')
+    # autoscale once all peaks and precursor markers are in the data limits
+    ax.autoscale_view()
     # plt.legend()
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
@@ -227,16 +440,14 @@ def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color
     ax.get_yaxis().tick_left()
     ax.set_xlabel(r"$m/z$", fontsize = 12)
     ax.set_ylabel(r"$Intensity\,[\%]$", fontsize = 12)
-    plt.xticks(rotation='vertical')
-    start, end = ax.get_xlim()
+    ax.tick_params(axis = 'x', labelrotation = 90)
     # start, end = ax.get_xlim(), 
     if(lower!=None and upper!= None):
         ax.set_xlim(lower, upper)
     ax.set_ylim(0, 100)
-    plt.axhline(y=0, color='black', linestyle='-')
-    start, end = ax.get_ylim()
+    ax.axhline(y=0, color='black', linestyle='-')
     # ax.yaxis.set_ticks(np.arange(start, end + 1, 10))
-    plt.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
+    ax.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
     ax.grid(False)
     ax.set_facecolor("white")
     ax.spines['bottom'].set_color('black')
@@ -247,11 +458,14 @@ def ms2_plot(msms_1, pmz = None, lower=None, upper=None, savepath = None, color
     fig.tight_layout()
     # fig.set(xlabel = None)
     if savepath != None:
-        fig.tight_layout()
-        plt.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'white')
+        fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'white')
 
-    return(plt)
-def ms2_overlay(msms_1=None,msms_2=None,msms_3 = None, pmz = None, savepath = None):
+    if show==True:
+        return(fig)
+    else:
+        return()
+@mpl.rc_context(_STYLE)
+def ms2_overlay(msms_1=None,msms_2=None,msms_3 = None, pmz = None, savepath = None, max_peaks = 2000, show = True):
     #
     # if pmz is not None:
     #     msms_1 = so.truncate_spectrum(msms_1, pmz-1.6)
@@ -259,29 +473,34 @@ def ms2_overlay(msms_1=None,msms_2=None,msms_3 = None, pmz = None, savepath = No
 
 
 
-    fig = plt.figure(figsize = (1.5,1.2))  
+    fig = _get_fig((1.5,1.2), reuse = not show)
 
     ax = fig.add_subplot()
+    # break_spectrum returns copies, so the intensities can be scaled in place
     if msms_1 is not None:
-        mass1, intensity1 = so.break_spectrum(msms_1)
-        intensity1 = [x/np.max(intensity1)*100 for x in intensity1]
-        for i in range(len(mass1)):
-
-            plt.vlines(x = mass1[i], ymin = 0, ymax = intensity1[i],color = 'orange', linewidth=0.3)
+        mass1, intensity1 = _top_peaks(*so.break_spectrum(msms_1), max_peaks)
+        intensity1 = np.asarray(intensity1, dtype = float)
+        _normalize(intensity1, out = intensity1)
+        mass1, intensity1 = _bin_peaks(mass1, intensity1, _axes_width_px(ax))
+        ax.add_collection(_peak_collection(mass1, intensity1, 'orange', 0.3))
 
     if msms_2 is not None:
-        mass2, intensity2 = so.break_spectrum(msms_2)
-        intensity2 = [x/np.max(intensity2)*100 for x in intensity2]
-        for i in range(len(mass2)):
-            plt.vlines(x = mass2[i], ymin = 0, ymax = intensity2[i],color = 'red', linewidth=0.35)
+        mass2, intensity2 = _top_peaks(*so.break_spectrum(msms_2), max_peaks)
+        intensity2 = np.asarray(intensity2, dtype = float)
+        _normalize(intensity2, out = intensity2)
+        mass2, intensity2 = _bin_peaks(mass2, intensity2, _axes_width_px(ax))
+        ax.add_collection(_peak_collection(mass2, intensity2, 'red', 0.35))
     if msms_3 is not None:
-        mass3, intensity3 = so.break_spectrum(msms_3)
-        intensity3 = [x/np.max(intensity3)*100 for x in intensity3]
-        for i in range(len(mass3)):
-            plt.vlines(x = mass3[i], ymin = 0, ymax = intensity3[i],color = 'blue', linewidth=0.4)
+        mass3, intensity3 = _top_peaks(*so.break_spectrum(msms_3), max_peaks)
+        intensity3 = np.asarray(intensity3, dtype = float)
+        _normalize(intensity3, out = intensity3)
+        mass3, intensity3 = _bin_peaks(mass3, intensity3, _axes_width_px(ax))
+        ax.add_collection(_peak_collection(mass3, intensity3, 'blue', 0.4))
 
     if pmz != None:
-        plt.vlines(x = pmz, ymin = 0, ymax = 100,color = 'grey', linestyle='dashed',linewidth=0.4)
+        ax.axvline(pmz, ymin = 0.0, ymax = 1.0, color = 'grey', linestyle='--', linewidth=0.4)
+    # autoscale once all peaks and precursor markers are in the data limits
+    ax.autoscale_view()
     # plt.legend()
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
@@ -294,13 +513,11 @@ def ms2_overlay(msms_1=None,msms_2=None,msms_3 = None, pmz = None, savepath = No
     ax.xaxis.set_tick_params(pad=0.1)
     ax.tick_params(labelsize=5)
     # plt.xticks(rotation='vertical')
-    start, end = ax.get_xlim()
     # start, end = ax.get_xlim(),
     ax.set_ylim(0, 100)
-    plt.axhline(y=0, color='black', linestyle='-')
-    start, end = ax.get_ylim()
+    ax.axhline(y=0, color='black', linestyle='-')
     # ax.yaxis.set_ticks(np.arange(start, end + 1, 10))
-    plt.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
+    ax.grid(True, axis="y", color='black', linestyle=':', linewidth=0.1)
     ax.grid(False)
     ax.set_facecolor("white")
     ax.spines['bottom'].set_color('black')
@@ -309,13 +526,15 @@ def ms2_overlay(msms_1=None,msms_2=None,msms_3 = None, pmz = None, savepath = No
     
     ax.spines['left'].set_color('black')
     # ax.set(xticklabels=[], yticklabels = [])
-    fig.tight_layout()
-    plt.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.1)
+    fig.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.1)
     # fig.set(xlabel = None)
     if savepath != None:
         fig.tight_layout()
-        plt.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'white')
+        fig.savefig(savepath, dpi = 300,facecolor = 'white', edgecolor = 'white')
 
-    return(plt)
+    if show==True:
+        return(fig)
+    else:
+        return()
 
 
@@ -101,8 +101,8 @@ def break_spectrum(spectra):
     if isinstance(spectra, float):
         return ([],[])
     spectra = np.array(spectra)
-    mass = spectra.T[0]
-    intensity = spectra.T[1]
+    mass = spectra[:, 0]
+    intensity = spectra[:, 1]
     return mass, intensity
 
 def pack_spectrum(mass, intensity):
@@ -314,6 +314,13 @@ def str_to_arr(msms):
     '''
     if isinstance(msms, float):
         return np.nan
+    # fast path: parse all numbers in one C-level pass, one 'mz\tintensity' pair per line
+    try:
+        spec_raw = np.fromstring(msms, dtype=np.float32, sep=' ')
+        if spec_raw.size == 2*(msms.count('\n')+1):
+            return spec_raw.reshape(-1, 2)
+    except ValueError:
+        pass
     spec_raw = np.array([x.split('\t') for x in msms.split('\n')], dtype=np.float32)
     return(spec_raw)
 
@@ -323,6 +330,13 @@ def str_to_arr(msms):
 def msdial_to_array(msms):
     if isinstance(msms, float):
         return np.nan
+    # fast path: parse all numbers in one C-level pass, one 'mz:intensity' pair per space-separated item
+    try:
+        spec_raw = np.fromstring(msms.replace(':', ' '), dtype=np.float32, sep=' ')
+        if spec_raw.size == 2*(msms.count(' ')+1):
+            return spec_raw.reshape(-1, 2)
+    except ValueError:
+        pass
     spec_raw = np.array([x.split(':') for x in msms.split(' ')], dtype=np.float32)
     return spec_raw
 